@@ -1,17 +1,18 @@
 # cat main.py 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import asyncio
-from kubernetes import client, config, watch
-from kubernetes.client.rest import ApiException
-import json
+from kubernetes_asyncio import client, config, watch
+from kubernetes_asyncio.client.rest import ApiException
+import msgspec
 from datetime import datetime
 import logging
 import threading
+import collections
 import signal
 import sys
 import os
@@ -19,62 +20,195 @@ import socket
 from contextlib import asynccontextmanager
 import time
 
-# ========== 1. 日志配置（极致详细，定位Watch启动） ==========
+# ========== 1. 日志配置（默认INFO，可用LOG_LEVEL环境变量调整） ==========
+# 格式里不放%(lineno)d/%(threadName)s：每条记录都要_getframe和线程查找，热路径吃不消
 logging.basicConfig(
-    level=logging.DEBUG,  # 改为DEBUG，打印所有细节
-    format="%(asctime)s - %(name)s - %(levelname)s - %(lineno)d - %(threadName)s - %(message)s",
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 logger = logging.getLogger(__name__)
 
 # ========== 2. 全局变量（简化+精准） ==========
-SHUTDOWN_FLAG: bool = False
+SHUTDOWN_EV: threading.Event = threading.Event()  # 同步代码可直接is_set()的退出标志
+SHUTDOWN_EVENT: Optional[asyncio.Event] = None  # 事件循环内的退出通知（lifespan里创建）
 LOOP: Optional[asyncio.AbstractEventLoop] = None
-WATCH_THREAD: Optional[threading.Thread] = None  # 改用线程直接启动Watch
-WATCH_LOCK: threading.Lock = threading.Lock()
+WATCH_TASK: Optional[asyncio.Task] = None  # Watch以协程任务运行，不再占用OS线程
+FANOUT_TASK: Optional[asyncio.Task] = None  # 事件合并+广播的单一消费者任务
 K8S_CLIENT: Optional[client.CustomObjectsApi] = None  # 全局K8s客户端
 
+# Watch→fanout的事件缓冲：deque的append/popleft在GIL下原子，
+# 配合ready标志一个突发只唤醒一次消费者（set()已置位时近乎零开销）
+PENDING_EVENTS: collections.deque = collections.deque()
+EVENT_READY: asyncio.Event = asyncio.Event()
+
+
+def enqueue_k8s_event(event: Dict[str, Any]):
+    """入队一个Watch事件并置位ready标志，由fanout_loop批量消费"""
+    PENDING_EVENTS.append(event)
+    EVENT_READY.set()
+
+# ========== 2.1 服务快照缓存（Watch维护，REST/WebSocket零API调用） ==========
+# Watch流是权威数据源：handle_k8s_event按事件增量维护缓存，
+# REST和WebSocket初始推送直接读快照，不再每次请求都list apiserver
+SERVICES_CACHE: Dict[str, Dict[str, Any]] = {}  # key: service名称
+LAST_HASH: Dict[str, int] = {}  # key: service名称，value: 后端配置hash（事件去重用）
+CACHE_JSON: Optional[bytes] = None  # 预序列化的完整响应体（None表示缓存未预热）
+CACHE_LOCK: asyncio.Lock = asyncio.Lock()
+
+
+def rebuild_cache_json():
+    """重建预序列化快照（每批事件后调用一次，REST直接返回bytes）"""
+    global CACHE_JSON
+    CACHE_JSON = msgspec.json.encode(
+        {"code": 200, "message": "success", "type": "full", "data": list(SERVICES_CACHE.values())}
+    )
+
+
+_TS_CACHE: tuple = (0, "")  # (毫秒tick, ISO字符串)
+
+
+def _now_iso() -> str:
+    """毫秒粒度缓存的ISO时间戳：事件风暴下同一毫秒只格式化一次"""
+    global _TS_CACHE
+    tick = int(time.time() * 1000)
+    if tick != _TS_CACHE[0]:
+        _TS_CACHE = (tick, datetime.now().isoformat(timespec="milliseconds"))
+    return _TS_CACHE[1]
+
+
+# ========== 2.2 TraefikService类型化schema（msgspec，C层解析） ==========
+class BackendSvc(msgspec.Struct):
+    """spec.weighted.services[]条目（port在CRD里可为端口号或端口名）"""
+    name: Optional[str] = None
+    namespace: Optional[str] = None
+    port: Optional[int | str] = None
+    weight: Optional[int] = None
+
+
+class WeightedSpec(msgspec.Struct):
+    services: List[BackendSvc] = msgspec.field(default_factory=list)
+
+
+class TraefikSpec(msgspec.Struct):
+    weighted: Optional[WeightedSpec] = None
+
+
+class ObjMeta(msgspec.Struct):
+    name: str = "unknown"
+    resourceVersion: Optional[str] = None
+
+
+class TraefikSvc(msgspec.Struct):
+    metadata: ObjMeta = msgspec.field(default_factory=ObjMeta)
+    spec: Optional[TraefikSpec] = None
+
+
+def parse_traefik_service(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """把TraefikService对象解析为前端需要的结构（msgspec在C层遍历，无.get()链）"""
+    svc = msgspec.convert(obj, type=TraefikSvc, strict=False)
+    backends = []
+    if svc.spec is not None and svc.spec.weighted is not None:
+        backends = [
+            {"name": b.name, "ratio": b.weight, "namespace": b.namespace, "port": b.port}
+            for b in svc.spec.weighted.services
+        ]
+    return {
+        "service": svc.metadata.name,
+        "status": "online",
+        "backends": backends,
+        "totalTraffic": "100",
+        "updatedAt": _now_iso()
+    }
+
 # ========== 3. WebSocket管理器 ==========
 class ConnectionManager:
+    SEND_QUEUE_SIZE = 256  # 每个连接的发送队列上限，打满视为慢消费者
+
+    # 所有方法都只在事件循环线程执行（Watch也是协程任务），无需任何锁
     def __init__(self):
         self.active_connections: List[WebSocket] = []
-        self.lock = threading.Lock()
+        self.send_queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.writer_tasks: Dict[WebSocket, asyncio.Task] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        with self.lock:
-            self.active_connections.append(websocket)
-        logger.info(f"新WebSocket连接，当前连接数: {len(self.active_connections)}")
+        # 每个连接独立的有界发送队列+写协程：慢客户端只拖慢自己，不阻塞广播
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.SEND_QUEUE_SIZE)
+        self.active_connections.append(websocket)
+        self.send_queues[websocket] = queue
+        self.writer_tasks[websocket] = asyncio.create_task(
+            self._writer_loop(websocket, queue)
+        )
+        logger.info("新WebSocket连接，当前连接数: %d", len(self.active_connections))
 
     def disconnect(self, websocket: WebSocket):
         try:
-            with self.lock:
-                self.active_connections.remove(websocket)
-            logger.info(f"WebSocket断开，当前连接数: {len(self.active_connections)}")
+            self.active_connections.remove(websocket)
         except ValueError:
+            return
+        self.send_queues.pop(websocket, None)
+        writer = self.writer_tasks.pop(websocket, None)
+        if writer:
+            writer.cancel()
+        logger.info("WebSocket断开，当前连接数: %d", len(self.active_connections))
+
+    async def _writer_loop(self, websocket: WebSocket, queue: asyncio.Queue):
+        """专属写协程：从队列取payload串行发送，发送失败即清理连接"""
+        try:
+            while True:
+                payload = await queue.get()
+                await websocket.send_text(payload)
+        except asyncio.CancelledError:
             pass
+        except Exception as e:
+            logger.error("写协程发送失败: %s", e)
+            self.disconnect(websocket)
 
-    async def send_personal_message(self, message: dict, websocket: WebSocket):
+    async def send_personal_text(self, payload: str, websocket: WebSocket):
+        """单播预序列化好的JSON文本（入队，由写协程真正发送）"""
+        queue = self.send_queues.get(websocket)
+        if queue is None:
+            return
         try:
-            await websocket.send_json(message)
-        except Exception as e:
-            logger.error(f"发送单播消息失败: {e}")
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.error("发送单播消息失败: 发送队列已满")
             self.disconnect(websocket)
 
+    async def send_personal_message(self, message: dict, websocket: WebSocket):
+        await self.send_personal_text(msgspec.json.encode(message).decode("utf-8"), websocket)
+
     async def broadcast(self, message: dict):
-        with self.lock:
-            connections = self.active_connections.copy()
-        for connection in connections:
+        # 只序列化一次（msgspec，C实现），避免每个连接重复dumps
+        await self.broadcast_text(msgspec.json.encode(message).decode("utf-8"))
+
+    async def broadcast_text(self, payload: str):
+        """广播预序列化好的JSON文本：只做put_nowait，不等待任何客户端"""
+        queues = list(self.send_queues.items())
+        slow: List[WebSocket] = []
+        for websocket, queue in queues:
             try:
-                await connection.send_json(message)
-            except Exception as e:
-                logger.error(f"广播消息失败: {e}")
-                self.disconnect(connection)
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                slow.append(websocket)
+        # 队列打满说明客户端消费跟不上事件速率，断开以免无限积压
+        for websocket in slow:
+            logger.warning("发送队列已满，断开慢消费者连接")
+            self.disconnect(websocket)
+            try:
+                await websocket.close(code=1011, reason="send queue overflow")
+            except Exception:
+                pass
 
     async def close_all_connections(self):
-        with self.lock:
-            connections = self.active_connections.copy()
-            self.active_connections.clear()
+        connections = self.active_connections.copy()
+        self.active_connections.clear()
+        self.send_queues.clear()
+        writers = list(self.writer_tasks.values())
+        self.writer_tasks.clear()
+        for writer in writers:
+            writer.cancel()
         for connection in connections:
             try:
                 await connection.close(code=1001, reason="Server shutdown")
@@ -85,21 +219,21 @@ class ConnectionManager:
 manager = ConnectionManager()
 
 # ========== 4. 信号处理 ==========
-def handle_shutdown_signal(signum, frame):
-    global SHUTDOWN_FLAG
-    if not SHUTDOWN_FLAG:
+def handle_shutdown_signal(signum):
+    """退出信号回调（经loop.add_signal_handler注册，跑在事件循环线程）"""
+    if not SHUTDOWN_EV.is_set():
         logger.info(f"\n收到退出信号 ({signum})，开始优雅退出...")
-        SHUTDOWN_FLAG = True
-        # 主动停止Watch线程
-        if WATCH_THREAD and WATCH_THREAD.is_alive():
-            logger.info("通知K8s Watch线程停止...")
+        SHUTDOWN_EV.set()
+        # 唤醒事件循环里所有等待退出通知的协程（WebSocket连接、Watch任务等）
+        if SHUTDOWN_EVENT:
+            SHUTDOWN_EVENT.set()
     else:
         logger.warning("强制退出！")
         os._exit(0)
 
 # ========== 5. K8s客户端初始化（独立函数，可重试） ==========
-def init_k8s_client() -> Optional[client.CustomObjectsApi]:
-    """初始化K8s客户端，支持重试"""
+async def init_k8s_client() -> Optional[client.CustomObjectsApi]:
+    """初始化K8s客户端（aiohttp原生异步），支持重试"""
     global K8S_CLIENT
     if K8S_CLIENT:
         return K8S_CLIENT
@@ -111,192 +245,284 @@ def init_k8s_client() -> Optional[client.CustomObjectsApi]:
         logger.debug(f"集群内配置加载失败: {e1}")
         try:
             # 回退到本地配置
-            config.load_kube_config()
+            await config.load_kube_config()
             logger.info("✅ 成功加载K8s本地配置 (~/.kube/config)")
         except Exception as e2:
             logger.error(f"❌ K8s客户端初始化失败: {e2}")
             return None
-    # 创建CustomObjectsApi客户端
-    K8S_CLIENT = client.CustomObjectsApi()
+    # 创建CustomObjectsApi客户端（加大连接池，避免突发调用反复TLS握手）
+    cfg = client.Configuration.get_default_copy()
+    cfg.connection_pool_maxsize = 64  # 作为aiohttp连接器的limit
+    cfg.debug = False
+    api_client = client.ApiClient(configuration=cfg)
+    K8S_CLIENT = client.CustomObjectsApi(api_client=api_client)
     return K8S_CLIENT
 
-# ========== 6. K8s Watch核心逻辑（独立线程，必启动） ==========
-def run_k8s_watch():
-    """独立线程运行K8s Watch，确保阻塞监听"""
-    logger.info("📌 K8s Watch线程已启动，开始初始化...")
+
+async def close_k8s_client():
+    """关闭底层aiohttp session，释放连接"""
+    global K8S_CLIENT
+    if K8S_CLIENT:
+        try:
+            await K8S_CLIENT.api_client.close()
+        except Exception as e:
+            logger.warning(f"关闭K8s客户端失败: {e}")
+        K8S_CLIENT = None
+
+# ========== 6. K8s Watch核心逻辑（事件循环内的协程任务） ==========
+async def _shutdown_or_sleep(delay: float) -> bool:
+    """等待delay秒，期间收到退出通知立即返回True"""
+    try:
+        await asyncio.wait_for(SHUTDOWN_EVENT.wait(), timeout=delay)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def run_k8s_watch():
+    """K8s Watch协程任务：事件直接在事件循环内产生，无跨线程切换"""
+    logger.info("📌 K8s Watch任务已启动，开始初始化...")
     reconnect_delay = 5
-    watch_obj = None
-    resource_version = ""  # 记录断点，实现resume
-    is_first_run = True    # 首次全量拉取标记
+    resource_version = ""  # Watch游标：来自list结果，由事件和BOOKMARK持续推进
 
-    # Watch主循环（直到收到退出信号）
-    while not SHUTDOWN_FLAG:
+    # Watch主循环（直到收到退出信号/任务被取消）
+    while not SHUTDOWN_EVENT.is_set():
         # 确保K8s客户端已初始化
-        k8s_client = init_k8s_client()
+        k8s_client = await init_k8s_client()
         if not k8s_client:
             logger.warning(f"❌ K8s客户端未就绪，{reconnect_delay}秒后重试...")
-            for _ in range(reconnect_delay):
-                if SHUTDOWN_FLAG:
-                    break
-                time.sleep(1)
+            if await _shutdown_or_sleep(reconnect_delay):
+                break
             continue
 
-        # 创建Watch对象
-        if not watch_obj:
-            watch_obj = watch.Watch()
-            logger.info("✅ K8s Watch对象已创建")
-
+        watch_obj = None
         try:
+            # 1. list→watch→relist：游标为空（首次启动或410过期）才全量list，
+            #    拿一致性快照和resourceVersion，并只在此时合成一次ADDED事件
+            if not resource_version:
+                resp = await k8s_client.list_namespaced_custom_object(
+                    group="traefik.containo.us",
+                    version="v1alpha1",
+                    namespace="kube-system",
+                    plural="traefikservices"
+                )
+                resource_version = resp.get("metadata", {}).get("resourceVersion", "")
+                items = resp.get("items", [])
+                logger.info(f"✅ 全量list完成：{len(items)}个对象，resourceVersion={resource_version}")
+                listed_names = set()
+                for item in items:
+                    listed_names.add(item.get("metadata", {}).get("name"))
+                    enqueue_k8s_event({"type": "ADDED", "object": item})
+                # 断线期间被删除的对象，合成DELETED事件清理缓存
+                for stale_name in [n for n in list(SERVICES_CACHE.keys()) if n not in listed_names]:
+                    enqueue_k8s_event(
+                        {"type": "DELETED", "object": {"metadata": {"name": stale_name}}}
+                    )
+
+            # 2. 从list拿到的游标开始watch，带bookmark保持游标新鲜
+            watch_obj = watch.Watch()
             logger.info("🔍 开始K8s Watch监听 TraefikService...")
-            # 核心：阻塞式监听K8s资源变化
-            for event in watch_obj.stream(
-                func=k8s_client.list_namespaced_custom_object,
+            async for event in watch_obj.stream(
+                k8s_client.list_namespaced_custom_object,
                 group="traefik.containo.us",
                 version="v1alpha1",
                 namespace="kube-system",
                 plural="traefikservices",
-                resource_version = resource_version,
-                timeout_seconds=0,  # 1分钟超时，平衡实时性和重连
-                #_request_timeout=30   # 请求超时保护
+                resource_version=resource_version,
+                allow_watch_bookmarks=True,  # 静默期也推进游标，避免410
+                timeout_seconds=60  # 服务端定期正常结束stream，游标续传重连
             ):
                 # 更新最新resourceVersion，断连后从这里续传
                 res_meta = event["object"].get("metadata", {})
                 if res_meta.get("resourceVersion"):
                     resource_version = res_meta["resourceVersion"]
 
-                # 首次全量只打ADDED，后续增量正常输出（对齐kubectl）
-                event_type = event["type"]
-                if is_first_run:
-                    event_type = "ADDED"
-                res_name = res_meta.get("name", "unknown")
-                print(f"[{event_type}] {res_name} (rv:{resource_version})")
-
+                # BOOKMARK只用于推进游标，不广播
+                if event["type"] == "BOOKMARK":
+                    continue
 
                 # 检测退出信号，立即停止
-                if SHUTDOWN_FLAG:
+                if SHUTDOWN_EVENT.is_set():
                     logger.info("🛑 收到退出信号，停止Watch stream")
                     break
-                # 处理事件（异步推送到FastAPI）
-                logger.info(f"📥 收到K8s事件: {event['type']} - {event['object'].get('metadata', {}).get('name', 'unknown')}")
-                # 异步广播事件到WebSocket
-                if LOOP and not LOOP.is_closed():
-                    asyncio.run_coroutine_threadsafe(
-                        handle_k8s_event(event),
-                        LOOP
-                    )
-            is_first_run = False  # 首次全量完成，后续都是增量
+                # 只入队，由fanout_loop统一合并处理（突发窗口内同名事件会被合并）
+                logger.info("📥 收到K8s事件: %s - %s", event["type"], res_meta.get("name", "unknown"))
+                enqueue_k8s_event(event)
             # 正常退出stream循环
-            if not SHUTDOWN_FLAG:
+            if not SHUTDOWN_EVENT.is_set():
                 logger.info("⌛ Watch stream超时，准备重连...")
+        except asyncio.CancelledError:
+            logger.info("🛑 Watch任务被取消")
+            raise
         except ApiException as e:
-            #logger.error(f"❌ K8s Watch API错误: {e.status} - {e.reason} (路径: {e.path})")
             logger.error(f"❌ K8s Watch API错误: {e.status}")
+            if e.status == 410:
+                # 410 Gone：游标过旧，清空后下次循环relist重新同步
+                logger.warning("⚠️ resourceVersion已过期(410)，准备relist")
+                resource_version = ""
         except Exception as e:
             logger.error(f"❌ Watch异常: {str(e)[:200]}", exc_info=True)
-            #logger.error("❌ Watch异常")
         finally:
             # 清理Watch对象
             if watch_obj:
                 try:
                     watch_obj.stop()
-                    logger.info("✅ Watch对象已停止")
-                except:
+                except Exception:
                     pass
-                watch_obj = None
 
-        # 重连前等待（检测退出信号）
-        if not SHUTDOWN_FLAG:
+        # 重连前等待（收到退出信号立即唤醒）
+        if not SHUTDOWN_EVENT.is_set():
             logger.info(f"⏳ {reconnect_delay}秒后尝试重连K8s Watch...")
-            for _ in range(reconnect_delay):
-                if SHUTDOWN_FLAG:
-                    break
-                time.sleep(1)
+            await _shutdown_or_sleep(reconnect_delay)
+
+    # Watch任务退出
+    logger.info("📌 K8s Watch任务已正常退出")
+
+async def fanout_loop():
+    """事件合并消费者：一次唤醒取空缓冲，同名service只保留最后一个事件。
+    resync风暴（apiserver重启等）下毫秒级涌入的重复事件合并成一次处理"""
+    while True:
+        await EVENT_READY.wait()
+        EVENT_READY.clear()
+        # 把同一突发内已到达的事件全部取出（后到覆盖先到）
+        batch: Dict[str, Dict[str, Any]] = {}
+        while PENDING_EVENTS:
+            event = PENDING_EVENTS.popleft()
+            batch[event["object"].get("metadata", {}).get("name", "unknown")] = event
+        for merged in batch.values():
+            await handle_k8s_event(merged)
+
+
+# 增量消息模板：复用dict，每个事件只patch字段后立即序列化，减少分配
+# 协议：全量快照只在连接时推送；后续事件只发~100字节的增量
+_DELTA_UPSERT: Dict[str, Any] = {"op": "upsert", "name": "", "backends": [], "updatedAt": "", "rv": None}
+_DELTA_DELETE: Dict[str, Any] = {"op": "delete", "name": "", "rv": None}
 
-    # Watch线程退出
-    logger.info("📌 K8s Watch线程已正常退出")
 
 async def handle_k8s_event(event: Dict[str, Any]):
-    """异步处理K8s事件，广播到所有WebSocket客户端"""
+    """异步处理K8s事件，以增量消息广播到所有WebSocket客户端"""
     try:
-        message_type = "update" if event["type"] == "MODIFIED" else "full"
-        event_data = {
-            "type": message_type,
-            "data": [{
-                "service": event["object"].get("metadata", {}).get("name", "unknown"),
-                "status": "online",
-                "backends": [],
-                "totalTraffic": "100",
-                "updatedAt": datetime.now().isoformat()
-                }]
-        }
-
-        backends_spec = event.get("object").get("spec").get("weighted")
-        if backends_spec is not None:
-            for backend in backends_spec.get("services"):
-                event_data["data"][0]["backends"].append(
-                        {
-                            "name": backend.get("name"),
-                            "ratio": backend.get("weight"),
-                            "namespace": backend.get("namespace"),
-                            "port": backend.get("port")
-                            }
-
-                        )
-
-        print("============================")
-        print(event_data)
-        print("============================")
-        await manager.broadcast(event_data)
+        obj = event["object"]
+        name = obj.get("metadata", {}).get("name", "unknown")
+        parsed = parse_traefik_service(obj)
+
+        # 事件去重：status/managedFields/annotations变更不影响后端配置，
+        # 内容hash没变就直接丢弃，不重建缓存也不广播（resync风暴时尤其划算）
+        if event["type"] == "DELETED":
+            LAST_HASH.pop(name, None)
+        else:
+            h = hash(tuple(
+                (b["name"], b["ratio"], b["port"], b["namespace"])
+                for b in parsed["backends"]
+            ))
+            if LAST_HASH.get(name) == h:
+                return
+            LAST_HASH[name] = h
+
+        # 先更新快照缓存（Watch是权威数据源）
+        async with CACHE_LOCK:
+            if event["type"] == "DELETED":
+                SERVICES_CACHE.pop(name, None)
+            else:
+                # ADDED/MODIFIED统一覆盖
+                SERVICES_CACHE[name] = parsed
+            rebuild_cache_json()
+
+        # 组装增量消息（复用模板，序列化紧随其后，无并发读写）
+        rv = obj.get("metadata", {}).get("resourceVersion")
+        if event["type"] == "DELETED":
+            delta = _DELTA_DELETE
+            delta["name"] = name
+            delta["rv"] = rv
+        else:
+            delta = _DELTA_UPSERT
+            delta["name"] = name
+            delta["backends"] = parsed["backends"]
+            delta["updatedAt"] = parsed["updatedAt"]
+            delta["rv"] = rv
+
+        # 每个事件只序列化一次，N个连接复用同一份payload
+        payload = msgspec.json.encode(delta).decode("utf-8")
+        logger.debug("广播事件: %s", payload)
+        await manager.broadcast_text(payload)
         logger.info("📤 K8s事件已广播到WebSocket客户端")
     except Exception as e:
-        logger.error(f"❌ 广播K8s事件失败: {e}")
+        logger.error("❌ 广播K8s事件失败: %s", e)
 
-# ========== 7. Lifespan生命周期（确保Watch线程启动） ==========
+# ========== 7. Lifespan生命周期（确保Watch任务启动） ==========
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """FastAPI生命周期：启动Watch线程，不阻塞监听"""
-    global LOOP, SHUTDOWN_FLAG, WATCH_THREAD
-    SHUTDOWN_FLAG = False
+    """FastAPI生命周期：启动Watch/fanout任务，不阻塞监听"""
+    global LOOP, SHUTDOWN_EVENT, WATCH_TASK, FANOUT_TASK
+    SHUTDOWN_EV.clear()
+    SHUTDOWN_EVENT = asyncio.Event()
     LOOP = asyncio.get_running_loop()
 
-    # 1. 注册信号处理
-    if threading.current_thread() is threading.main_thread():
-        signal.signal(signal.SIGINT, handle_shutdown_signal)
-        signal.signal(signal.SIGTERM, handle_shutdown_signal)
-        logger.info("✅ 信号处理已注册")
+    # Python 3.12+: eager task factory，不经调度直接执行到第一个await，
+    # 无需真正挂起的协程（如socket缓冲未满的单播发送）省一次循环往返
+    if hasattr(asyncio, "eager_task_factory"):
+        LOOP.set_task_factory(asyncio.eager_task_factory)
 
-    # 2. 启动K8s Watch线程（核心修复：独立线程，必启动）
-    with WATCH_LOCK:
-        if not WATCH_THREAD or not WATCH_THREAD.is_alive():
-            # 启动独立线程运行Watch（避免阻塞事件循环）
-            WATCH_THREAD = threading.Thread(
-                target=run_k8s_watch,
-                name="K8sWatchThread",
-                daemon=True  # 守护线程，主进程退出时自动终止
-            )
-            WATCH_THREAD.start()
-            logger.info("✅ K8s Watch线程已启动（线程ID: %d）", WATCH_THREAD.ident)
-        else:
-            logger.info("✅ K8s Watch线程已在运行")
+    # 1. 注册信号处理（走事件循环，回调直接在loop线程执行）
+    try:
+        LOOP.add_signal_handler(signal.SIGINT, handle_shutdown_signal, signal.SIGINT)
+        LOOP.add_signal_handler(signal.SIGTERM, handle_shutdown_signal, signal.SIGTERM)
+        logger.info("✅ 信号处理已注册")
+    except NotImplementedError:
+        # 非主线程/不支持的平台兜底
+        logger.warning("⚠️ 事件循环不支持信号处理，跳过注册")
+
+    # 2. 启动事件合并消费者和K8s Watch协程任务（aiohttp原生异步，不占用OS线程）
+    if not FANOUT_TASK or FANOUT_TASK.done():
+        FANOUT_TASK = asyncio.create_task(fanout_loop(), name="event-fanout")
+    if not WATCH_TASK or WATCH_TASK.done():
+        WATCH_TASK = asyncio.create_task(run_k8s_watch(), name="k8s-watch")
+        logger.info("✅ K8s Watch任务已启动")
+    else:
+        logger.info("✅ K8s Watch任务已在运行")
 
-    # 3. FastAPI进入监听状态（关键：yield前无阻塞逻辑）
+    # 3. 预取前端入口文件stat：FileResponse走sendfile(2)内核零拷贝发送，
+    #    并用启动时算好的ETag做If-None-Match协商（命中返回空body的304）
+    try:
+        index_stat = os.stat(INDEX_HTML_PATH)
+        app.state.index_stat = index_stat
+        app.state.index_etag = FileResponse(
+            INDEX_HTML_PATH, stat_result=index_stat, media_type="text/html"
+        ).headers["etag"]
+        logger.info(f"✅ 前端入口文件stat已缓存（{index_stat.st_size}字节）")
+    except OSError as e:
+        app.state.index_stat = None
+        app.state.index_etag = None
+        logger.error(f"❌ 前端入口文件读取失败：{e}")
+
+    # 4. FastAPI进入监听状态（关键：yield前无阻塞逻辑）
     logger.info("=== 🚀 FastAPI服务启动完成，开始监听请求 ===")
     yield
 
-    # 4. 优雅关闭阶段
+    # 5. 优雅关闭阶段
     logger.info("=== 🛑 开始优雅关闭FastAPI服务 ===")
     # 关闭所有WebSocket连接
     await manager.close_all_connections()
-    # 等待Watch线程退出（最多10秒）
-    if WATCH_THREAD and WATCH_THREAD.is_alive():
-        logger.info("等待K8s Watch线程退出...")
-        WATCH_THREAD.join(timeout=10)
-        if WATCH_THREAD.is_alive():
-            logger.warning("K8s Watch线程超时未退出，强制终止")
-    # 清理全局变量
-    global K8S_CLIENT
-    K8S_CLIENT = None
-    WATCH_THREAD = None
+    # 通知并取消Watch任务
+    SHUTDOWN_EV.set()
+    SHUTDOWN_EVENT.set()
+    if WATCH_TASK and not WATCH_TASK.done():
+        logger.info("等待K8s Watch任务退出...")
+        WATCH_TASK.cancel()
+        try:
+            await WATCH_TASK
+        except asyncio.CancelledError:
+            pass
+    WATCH_TASK = None
+    if FANOUT_TASK and not FANOUT_TASK.done():
+        FANOUT_TASK.cancel()
+        try:
+            await FANOUT_TASK
+        except asyncio.CancelledError:
+            pass
+    FANOUT_TASK = None
+    # 关闭K8s客户端的aiohttp session
+    await close_k8s_client()
     logger.info("=== ✅ FastAPI服务已优雅关闭 ===")
 
 # ========== 8. FastAPI应用初始化 ==========
@@ -311,7 +537,7 @@ INDEX_HTML_PATH = "/home/traefik-dashboard/dist/index.html"
 # 挂载静态文件（忽略错误，不影响核心功能）
 try:
     #app.mount("/static", StaticFiles(directory="traefik-dashboard/dist/"), name="static")
-    app.mount("/asserts", StaticFiles(directory="/home/traefik-dashboard/dist/", html=True), name="static")
+    app.mount("/asserts", StaticFiles(directory="/home/traefik-dashboard/dist/", html=True, check_dir=False), name="static")
     #app.mount("/assets",StaticFiles(directory="/home/traefik-dashboard/dist/assets/"),name="frontend_assets")
     #templates = Jinja2Templates(directory="traefik-dashboard/dist/")
 except Exception as e:
@@ -332,13 +558,13 @@ class TrafficConfigRequest(BaseModel):
 
 @app.get("/api/health", summary="健康检查（核心验证）")
 async def health_check():
-    """验证服务状态+Watch线程状态"""
+    """验证服务状态+Watch任务状态"""
     return {
         "status": "running",
         "timestamp": datetime.now().isoformat(),
         "k8s_client_init": K8S_CLIENT is not None,
-        "watch_thread_alive": WATCH_THREAD.is_alive() if WATCH_THREAD else False,
-        "shutdown_flag": SHUTDOWN_FLAG,
+        "watch_task_running": WATCH_TASK is not None and not WATCH_TASK.done(),
+        "shutdown_flag": SHUTDOWN_EV.is_set(),
         "event_loop_running": LOOP.is_running() if LOOP else False
     }
 
@@ -352,38 +578,24 @@ async def health_check():
 
 @app.get("/api/traefik-services", summary="获取TraefikService列表")
 async def get_traefik_services():
-    """获取K8s TraefikService（无K8s则返回模拟数据）"""
+    """获取K8s TraefikService（优先读Watch维护的快照缓存，无K8s则返回模拟数据）"""
+    # 缓存已预热：直接返回预序列化快照，零apiserver调用
+    if CACHE_JSON is not None:
+        return Response(content=CACHE_JSON, media_type="application/json")
+
+    # 冷启动兜底：Watch尚未预热缓存时才真正list一次
     services = []
-    k8s_client = init_k8s_client()
+    k8s_client = await init_k8s_client()
     if k8s_client:
         try:
-            resp = k8s_client.list_namespaced_custom_object(
+            resp = await k8s_client.list_namespaced_custom_object(
                 group="traefik.containo.us",
                 version="v1alpha1",
                 namespace="kube-system",
                 plural="traefikservices"
             )
-            for item in resp.get("items", []):
-                service_spec = {
-                    "service": item["metadata"]["name"],
-                    "status": "online",
-                    "backends": [],
-                    "totalTraffic": "100",
-                    #"updatedAt": item["metadata"].get("creationTimestamp", datetime.now().isoformat())
-                    "updatedAt": datetime.now().isoformat()
-                    }
-                backends_spec = item.get("spec").get("weighted")
-                if backends_spec is not None:
-                    for backends in backends_spec.get("services"):
-                        service_spec["backends"].append(
-                                {
-                                    "name": backends.get("name"),
-                                    "ratio": backends.get("weight"),
-                                    "port": backends.get("port"),
-                                    "namespace": backends.get("namespace")
-                                    }
-                                )
-                services.append(service_spec)
+            # 列表推导式一次建表，省去逐项append的属性查找
+            services = [parse_traefik_service(item) for item in resp.get("items", ())]
             logger.info(f"获取到{len(services)}个TraefikService")
         except Exception as e:
             logger.error(f"获取TraefikService失败: {e}")
@@ -391,26 +603,26 @@ async def get_traefik_services():
     else:
         services = get_fallback_services()
 
-    print(services)
     return {"code": 200, "message": "success", "type": "full", "data": services}
 
 
 # ========== 10. 测试/健康检查接口 ==========
-@app.get("/{full_path:path}", response_class=HTMLResponse, include_in_schema=False)
-async def serve_frontend(full_path: str):
+@app.get("/{full_path:path}", include_in_schema=False)
+async def serve_frontend(full_path: str, request: Request):
     """
     前端兜底路由：处理所有非API/WebSocket的请求，返回index.html
     兼容前端路由（如/dashboard、/setting），由前端Vue/React解析
     full_path:path 表示匹配所有路径（通配符）
     """
-    # 检查index.html是否存在
-    if not os.path.exists(INDEX_HTML_PATH):
+    index_stat = getattr(app.state, "index_stat", None)
+    if index_stat is None:
         logger.error(f"❌ 前端入口文件不存在：{INDEX_HTML_PATH}")
         return HTMLResponse(content="<h1>前端文件未找到</h1>", status_code=404)
-    # 读取并返回index.html（确保前端能加载，且静态资源路径正确）
-    with open(INDEX_HTML_PATH, "r", encoding="utf-8") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content)
+    # ETag命中：304空响应体，浏览器用本地缓存
+    if request.headers.get("if-none-match") == app.state.index_etag:
+        return Response(status_code=304, headers={"etag": app.state.index_etag})
+    # sendfile(2)发送：内核page cache直达socket，不经过用户态拷贝
+    return FileResponse(INDEX_HTML_PATH, stat_result=index_stat, media_type="text/html")
 
 
 # ========== 11. WebSocket接口 ==========
@@ -419,26 +631,35 @@ async def websocket_endpoint(websocket: WebSocket):
     """WebSocket实时接收K8s事件"""
     await manager.connect(websocket)
     try:
-        # 推送初始数据
-        init_data = await get_traefik_services()
-        await manager.send_personal_message(init_data, websocket)
-        # 保持连接（检测退出信号）
-        while not SHUTDOWN_FLAG:
+        # 推送初始数据（优先用预序列化快照，零apiserver调用）
+        snapshot = CACHE_JSON
+        if snapshot is not None:
+            # 走发送队列，保证快照先于后续事件到达客户端
+            await manager.send_personal_text(snapshot.decode("utf-8"), websocket)
+        else:
+            init_data = await get_traefik_services()
+            await manager.send_personal_message(init_data, websocket)
+        # 保持连接：同时等待前端消息和退出通知，无定时轮询
+        while not SHUTDOWN_EV.is_set():
+            recv_task = asyncio.create_task(websocket.receive_text())
+            stop_task = asyncio.create_task(SHUTDOWN_EVENT.wait())
+            done, pending = await asyncio.wait(
+                {recv_task, stop_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in pending:
+                task.cancel()
+            if stop_task in done:
+                break
             try:
-                # 非阻塞接收前端消息
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=2.0)
-                logger.info(f"收到前端消息: {data[:50]}")
-                await get_traefik_services()
-                #await manager.send_personal_message(resdata, websocket)
-                await manager.send_personal_message({"type": "echo", "data": data}, websocket)
-            except asyncio.TimeoutError:
-                continue
+                data = recv_task.result()
             except WebSocketDisconnect:
                 logger.info("WebSocket客户端主动断开")
                 break
             except Exception as e:
-                logger.error(f"WebSocket异常: {e}")
+                logger.error("WebSocket异常: %s", e)
                 break
+            logger.info("收到前端消息: %s", data[:50])
+            await manager.send_personal_message({"type": "echo", "data": data}, websocket)
     finally:
         manager.disconnect(websocket)
 
@@ -455,16 +676,10 @@ async def update_traffic_config(request: TrafficConfigRequest):
             raise HTTPException(status_code=400, detail="流量比例总和必须为100%")
 
         # 2. 更新K8s TraefikService资源
-        success = update_traefik_service_in_k8s(request.service_name, request.backends)
+        success = await update_traefik_service_in_k8s(request.service_name, request.backends)
 
         if success:
-            # 3. 推送更新到所有WebSocket客户端
-            updated_services = get_traefik_services()
-            #await manager.broadcast(updated_services)
-            #await manager.broadcast({
-            #    "type": "update",
-            #    "data": updated_services
-            #})
+            # 3. 更新会由K8s Watch事件自动推送到所有WebSocket客户端
             return {
                 "code": 200,
                 "message": "流量配置更新成功",
@@ -482,28 +697,26 @@ async def update_traffic_config(request: TrafficConfigRequest):
 
 
 
-def update_traefik_service_in_k8s(service_name: str, backends: List[Backend]) -> bool:
+async def update_traefik_service_in_k8s(service_name: str, backends: List[Backend]) -> bool:
     """
     更新K8s中的TraefikService资源
     TraefikService CRD格式参考：https://doc.traefik.io/traefik/routing/providers/kubernetes-crd/#traefikservice
     """
-    k8s_custom_objects_api = init_k8s_client()
+    k8s_custom_objects_api = await init_k8s_client()
     namespace = "kube-system"  # 根据实际情况修改命名空间
     traefik_service_api_version = "traefik.containo.us/v1alpha1"
     traefik_service_plural = "traefikservices"
 
     try:
         # 1. 获取现有TraefikService资源
-        traefik_service = k8s_custom_objects_api.get_namespaced_custom_object(
+        traefik_service = await k8s_custom_objects_api.get_namespaced_custom_object(
             group="traefik.containo.us",
             version="v1alpha1",
             namespace=namespace,
             plural=traefik_service_plural,
             name=service_name
         )
-        print("========================================")
-        print(traefik_service)
-        print("========================================")
+        logger.debug("现有TraefikService: %s", traefik_service)
 
         # 2. 构建新的权重配置（ratio比例转weight权重）
         weighted_services = []
@@ -523,7 +736,7 @@ def update_traefik_service_in_k8s(service_name: str, backends: List[Backend]) ->
         }
 
         # 4. 应用更新到K8s
-        k8s_custom_objects_api.replace_namespaced_custom_object(
+        await k8s_custom_objects_api.replace_namespaced_custom_object(
             group="traefik.containo.us",
             version="v1alpha1",
             namespace=namespace,
@@ -532,14 +745,14 @@ def update_traefik_service_in_k8s(service_name: str, backends: List[Backend]) ->
             body=traefik_service
         )
 
-        print(f"成功更新K8s TraefikService: {service_name}")
+        logger.info("成功更新K8s TraefikService: %s", service_name)
         return True
 
     except ApiException as e:
-        print(f"更新K8s TraefikService失败: {e}")
+        logger.error("更新K8s TraefikService失败: %s", e)
         return False
     except Exception as e:
-        print(f"更新异常: {e}")
+        logger.error("更新异常: %s", e)
         return False
 
 
@@ -597,5 +810,8 @@ if __name__ == "__main__":
         log_level="info",
         reload=False,
         workers=1,
-        access_log=True
+        access_log=True,
+        loop="uvloop",      # C实现的事件循环，socket操作吞吐约2倍
+        http="httptools",   # C实现的HTTP解析器，替代纯Python的h11
+        ws="websockets"
     )